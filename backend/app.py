@@ -1,16 +1,48 @@
 # backend/app.py
-from flask import Flask, request, jsonify
-from content_based import load_and_preprocess_data, build_similarity_matrix, get_recommendations
+from flask import Flask, request, jsonify, copy_current_request_context
+from flask.json.provider import DefaultJSONProvider
+from content_based import (
+    load_and_preprocess_cached, SimilarityRows, build_top_k_table, build_top_k_scores, build_title_index,
+    get_recommendations, features_digest, cached_array, unit_rows, build_type_masks, combine_type_masks,
+    top_k_positions, SIMILARITY_CACHE_VERSION
+)
+from cache_files import remove_stale_cache_files
+from collab_filtering import (
+    load_user_item_matrix, index_of, predict_item_ratings, build_prediction_table, load_model
+)
+import numpy as np
 import pandas as pd
-from surprise import Dataset, Reader, SVD
-import pickle
 import os
 import logging
-from functools import lru_cache
+import orjson
+import time
+from functools import wraps, lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
 from flask_caching import Cache
 from flask_cors import CORS
 
+class OrjsonProvider(DefaultJSONProvider):
+    """JSON provider that serializes with orjson (numpy-aware, sorted keys like Flask's default)"""
+    def _options(self, indent):
+        option = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_SORT_KEYS
+        return option | orjson.OPT_INDENT_2 if indent else option
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=self._options(kwargs.get('indent'))).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        """Same as the default jsonify response, but the body is orjson's bytes as-is (no str round trip)"""
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        body = orjson.dumps(obj, default=self.default, option=self._options(indent) | orjson.OPT_APPEND_NEWLINE)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 CORS(app, resources={
     r"/recommend/*": {
         "origins": ["http://localhost:8080", "http://127.0.0.1:8080"],
@@ -23,10 +55,6 @@ CORS(app, resources={
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Configure caching
-cache = Cache(config={'CACHE_TYPE': 'SimpleCache'})
-cache.init_app(app)
-
 # Configuration for model
 CONFIG = {
     'content_weight': 0.6,  # Slightly higher weight for content
@@ -34,14 +62,37 @@ CONFIG = {
     'top_n_hybrid': 10,
     'default_recommendations': 5,
     'max_recommendations': 20,
-    'cache_timeout': 300
+    'cache_timeout': 300,
+    'similarity_top_k': 200,  # Neighbours kept per anime for content lookups
+    'user_prediction_cache_size': 256  # Users whose catalog-wide predictions stay in memory
 }
 
+# Hot-path settings bound once instead of looked up in CONFIG on every request
+DEFAULT_N = CONFIG['default_recommendations']
+MAX_N = CONFIG['max_recommendations']
+CACHE_TIMEOUT = CONFIG['cache_timeout']
+
+# Configure caching (Redis is shared by all workers; SimpleCache is per-process)
+redis_url = os.environ.get('REDIS_URL')
+if redis_url:
+    cache_config = {
+        'CACHE_TYPE': 'RedisCache',
+        'CACHE_REDIS_URL': redis_url,
+        'CACHE_KEY_PREFIX': 'ani-match:'
+    }
+else:
+    cache_config = {'CACHE_TYPE': 'SimpleCache'}
+cache_config['CACHE_DEFAULT_TIMEOUT'] = CACHE_TIMEOUT
+cache = Cache(config=cache_config)
+cache.init_app(app)
+
 # Get absolute paths to data files
 backend_dir = os.path.dirname(os.path.abspath(__file__))
 project_root = os.path.dirname(backend_dir)
 data_path = os.path.join(project_root, 'data', 'anime_clean.csv')
 ratings_path = os.path.join(project_root, 'data', 'clean_ratings.csv')
+model_path = os.path.join(backend_dir, 'collab_model')
+cache_dir = os.path.join(backend_dir, 'cache')
 
 # Verify files exist
 if not os.path.exists(data_path):
@@ -49,10 +100,55 @@ if not os.path.exists(data_path):
 if not os.path.exists(ratings_path):
     raise FileNotFoundError(f"Ratings data not found at: {ratings_path}")
 
-# Load data
-ratings_df = pd.read_csv(ratings_path)
-df, features = load_and_preprocess_data(data_path)
-similarity_matrix = build_similarity_matrix(features)
+# Sparse user x anime matrix: a user's rated anime are one CSR row slice.
+# It is cached next to the similarity arrays, so restarts don't re-parse the ratings.
+user_item_matrix = load_user_item_matrix(ratings_path, cache_dir)
+
+# Preprocessed catalog and features, cached as Parquet under the same directory
+df, features = load_and_preprocess_cached(data_path, cache_dir)
+
+# Similarity rows are computed on demand from the normalized features (no N x N
+# matrix); the normalized rows, the neighbour table and its scores are cached on
+# disk under SIMILARITY_CACHE_VERSION and a hash of the features, so restarts
+# memory-map them instead of recomputing
+features_key = f"v{SIMILARITY_CACHE_VERSION}-{features_digest(features)}"
+unit_name = f"unit-{features_key}.npy"
+top_k_name = f"top{CONFIG['similarity_top_k']}-{features_key}.npy"
+top_k_scores_name = f"top{CONFIG['similarity_top_k']}-scores-{features_key}.npy"
+# Arrays of older catalogs, versions or top-K sizes are never read again
+os.makedirs(cache_dir, exist_ok=True)
+remove_stale_cache_files(cache_dir, ('unit-', 'top'), (unit_name, top_k_name, top_k_scores_name))
+similarity_matrix = SimilarityRows(
+    features,
+    unit=cached_array(os.path.join(cache_dir, unit_name), lambda: unit_rows(features))
+)
+top_k_table = cached_array(
+    os.path.join(cache_dir, top_k_name),
+    lambda: build_top_k_table(similarity_matrix, CONFIG['similarity_top_k'])
+)
+top_k_scores = cached_array(
+    os.path.join(cache_dir, top_k_scores_name),
+    lambda: build_top_k_scores(similarity_matrix, top_k_table)
+)
+title_index = build_title_index(df)
+type_masks = build_type_masks(df)
+
+# Catalog rows from most to fewest members, so cold-start picks are a filtered prefix
+popularity_order = df['members'].sort_values(ascending=False, kind='stable').index.to_numpy()
+
+# Give each catalog genre its own bit so genre-set overlap is integer AND/OR + popcount.
+# Built once and only read afterwards, so request threads can share it.
+genre_bits = {
+    genre: 1 << i
+    for i, genre in enumerate(sorted({g for genres in df['genre'] for g in genres}))
+}
+
+def genre_mask(genres):
+    """Encode a list of genres as a bitmask over genre_bits (genres outside the catalog are skipped)"""
+    mask = 0
+    for genre in genres:
+        mask |= genre_bits.get(genre, 0)
+    return mask
 
 def normalize_score(score, max_score):
     """Normalize score to 0-1 range"""
@@ -61,17 +157,46 @@ def normalize_score(score, max_score):
 def validate_n_parameter(n):
     """Validate and normalize the n parameter"""
     if n is None:
-        return CONFIG['default_recommendations']
+        return DEFAULT_N
     try:
         n = int(n)
-        return max(1, min(n, CONFIG['max_recommendations']))
+        return max(1, min(n, MAX_N))
     except (ValueError, TypeError):
-        return CONFIG['default_recommendations']
+        return DEFAULT_N
+
+def normalize_type(anime_type):
+    """Canonical type filter: lowercase, trimmed, de-duplicated and sorted ('TV, Movie' -> 'movie,tv')"""
+    types = sorted({t.strip().lower() for t in anime_type.split(',')} - {''})
+    return ','.join(types) if types else 'all'
 
-def filter_by_type(df_subset, anime_type):
-    """Filter anime DataFrame by type(s)"""
+def recommendation_args():
+    """Parse the shared query parameters once: (title, user_id, n, type), normalized like the cache key"""
+    title = request.args.get('title', default='', type=str).strip()
+    user_id = request.args.get('user_id', type=int)
+    n = validate_n_parameter(request.args.get('n', type=int))
+    anime_type = normalize_type(request.args.get('type', default='all', type=str))
+    return title, user_id, n, anime_type
+
+def recommendation_cache_key():
+    """Cache key that ignores query order, title case or padding, type list order and how numbers are spelled"""
+    params = {key: value.strip() for key, value in request.args.items()}
+    if 'title' in params:
+        params['title'] = params['title'].lower()
+    params['type'] = normalize_type(request.args.get('type', default='all', type=str))
+    # Parse numbers the way the endpoints do, so n=05, n=5 and n=500 (clamped) share entries
+    params['n'] = validate_n_parameter(request.args.get('n', type=int))
+    user_id = request.args.get('user_id', type=int)
+    if user_id is not None:
+        params['user_id'] = user_id
+    return f"{request.path}?{urlencode(sorted(params.items()))}"
+
+def type_mask(df_subset, anime_type, type_masks=None):
+    """Boolean row mask for type(s), or None when no type filter applies
+
+    type_masks (from build_type_masks on df_subset) avoids touching the type strings.
+    """
     if not anime_type or anime_type.lower() == 'all':
-        return df_subset
+        return None
     
     # Handle multiple types (comma-separated)
     if isinstance(anime_type, str):
@@ -79,153 +204,239 @@ def filter_by_type(df_subset, anime_type):
     else:
         types = [str(anime_type).lower()]
     
-    # Create a boolean mask for filtering
-    mask = df_subset['type'].str.lower().isin(types)
-    filtered_df = df_subset[mask]
-    
-    logger.info(f"Filtered from {len(df_subset)} to {len(filtered_df)} anime for types: {types}")
-    return filtered_df
+    if type_masks is not None:
+        return combine_type_masks(type_masks, types, len(df_subset))
+    return df_subset['type'].str.lower().isin(types).to_numpy()
 
 # backend/app.py
-def get_collab_recommendations(user_id, model, anime_df, ratings_df, n=5, anime_type=None):
-    """Get collaborative filtering recommendations with proper n parameter handling and type filtering"""
+def get_collab_recommendations(user_id, model, anime_df, user_item, n=5, anime_type=None, prediction_table=None,
+                               item_index=None, catalog_predictions=None, type_masks=None, popularity_order=None):
+    """Get collaborative filtering recommendations with proper n parameter handling and type filtering
+
+    item_index holds the model factor row of each anime_df row (see index_of);
+    it is resolved here when not precomputed by the caller. catalog_predictions
+    may hold the user's predicted rating for every anime_df row (e.g. cached per
+    user); otherwise only the candidates are scored. type_masks are the
+    build_type_masks output for anime_df, and popularity_order its row positions
+    sorted by members (descending) for users without ratings.
+    """
     n = validate_n_parameter(n)
     
     # Get anime user has already rated
-    rated_anime = ratings_df[ratings_df['user_id'] == user_id]['anime_id'].tolist()
+    rated_anime = user_item.rated_anime(user_id)
     
-    # Apply type filtering to the full anime DataFrame
-    filtered_df = filter_by_type(anime_df, anime_type)
+    # Candidate rows of the requested type, kept as a boolean mask over anime_df
+    anime_ids = anime_df['anime_id'].to_numpy()
+    candidates = type_mask(anime_df, anime_type, type_masks)
+    if candidates is None:
+        candidates = np.ones(len(anime_df), dtype=bool)
     
-    if filtered_df.empty:
+    if not candidates.any():
         logger.warning(f"No anime found for type filter: {anime_type}")
         return []
     
-    # Get all anime not rated by user (from filtered set)
-    unrated_anime = filtered_df[~filtered_df['anime_id'].isin(rated_anime)]
-    
     # If no ratings exist for user, return popular anime from filtered set
-    if not rated_anime:
-        popular_anime = unrated_anime.sort_values('members', ascending=False).head(n)
-        recommendations = []
-        for _, row in popular_anime.iterrows():
-            recommendations.append({
-                'Anime': row['name'],
-                'Predicted Rating': float(f"{row['rating']:.2f}") if pd.notna(row['rating']) else 5.0,
-                'Genres': row['genre'],
-                'Type': row['type'],
-                'Collab_Score': normalize_score(row['rating'] if pd.notna(row['rating']) else 5.0, 10)
-            })
-        return recommendations
+    # (nothing to exclude, so the rated-anime lookup is skipped entirely)
+    if len(rated_anime) == 0:
+        if popularity_order is None:
+            popularity_order = anime_df['members'].sort_values(ascending=False, kind='stable').index.to_numpy()
+        popular_rows = popularity_order[candidates[popularity_order]][:n]
+        return [
+            {
+                'Anime': name,
+                'Predicted Rating': round(float(rating), 2) if pd.notna(rating) else 5.0,
+                'Genres': genres,
+                'Type': anime_type_value,
+                'Collab_Score': normalize_score(rating if pd.notna(rating) else 5.0, 10)
+            }
+            for name, genres, anime_type_value, rating in zip(
+                anime_df['name'].to_numpy()[popular_rows],
+                anime_df['genre'].to_numpy()[popular_rows],
+                anime_df['type'].array[popular_rows],
+                anime_df['rating'].to_numpy()[popular_rows].tolist()
+            )
+        ]
     
-    user_predictions = []
+    # Drop anime the user has already rated via a boolean lookup indexed by anime_id
+    rated_lookup = np.zeros(max(anime_ids.max(), rated_anime.max()) + 1, dtype=bool)
+    rated_lookup[rated_anime] = True
+    candidates = candidates & ~rated_lookup[anime_ids]
     
-    # Get predictions for unrated anime in filtered set
-    for anime_id in unrated_anime['anime_id'].unique():
-        try:
-            pred = model.predict(user_id, anime_id)
-            user_predictions.append((anime_id, pred.est))
-        except Exception as e:
-            logger.warning(f"Prediction failed for anime_id {anime_id}: {str(e)}")
-            continue
+    # Row positions of the candidates (anime_df has one row per anime_id)
+    positions = np.flatnonzero(candidates)
     
-    # Sort by predicted rating and get top-N
-    user_predictions.sort(key=lambda x: x[1], reverse=True)
-    top_n = user_predictions[:n]
+    # Predict all candidates with one vectorized pass over their factor rows
+    if catalog_predictions is not None:
+        predictions = catalog_predictions[positions]
+    else:
+        if item_index is None:
+            item_index = index_of(model.anime_ids, anime_ids)
+        predictions = predict_item_ratings(model, user_id, item_index[positions], prediction_table)
     
-    # Prepare response
-    recommendations = []
-    for anime_id, rating in top_n:
-        try:
-            anime_row = filtered_df[filtered_df['anime_id'] == anime_id]
-            if anime_row.empty:
-                continue
-            anime = anime_row.iloc[0]
-            recommendations.append({
-                'Anime': anime['name'],
-                'Predicted Rating': float(f"{rating:.2f}"),
-                'Genres': anime['genre'],
-                'Type': anime['type'],
-                'Collab_Score': normalize_score(rating, 10)
-            })
-        except Exception as e:
-            logger.warning(f"Error processing anime_id {anime_id}: {str(e)}")
-            continue
+    # Partition out the top-N (ties at the cut kept in catalog order), then sort only those
+    order = top_k_positions(predictions, n)
+    top_rows = positions[order]
+    
+    # Prepare response by gathering the top-N rows from the column arrays (no sub-frame)
+    recommendations = [
+        {
+            'Anime': name,
+            'Predicted Rating': round(float(rating), 2),
+            'Genres': genres,
+            'Type': anime_type_value,
+            'Collab_Score': normalize_score(rating, 10)
+        }
+        for name, genres, anime_type_value, rating in zip(
+            anime_df['name'].to_numpy()[top_rows],
+            anime_df['genre'].to_numpy()[top_rows],
+            anime_df['type'].array[top_rows],
+            predictions[order]
+        )
+    ]
     
     return recommendations
 
-# Load or train collaborative model
-try:
-    collab_model = pickle.load(open('collab_model.pkl', 'rb'))
-    # Verify the loaded model has the predict method
-    if not hasattr(collab_model, 'predict'):
-        raise AttributeError("Loaded model is missing predict method")
-    logger.info("Collaborative model loaded successfully")
-except (FileNotFoundError, EOFError, AttributeError) as e:
-    logger.error(f"Model loading failed: {str(e)}")
-    logger.info("Training new collaborative model...")
-    reader = Reader(rating_scale=(1, 10))
-    data = Dataset.load_from_df(ratings_df[['user_id', 'anime_id', 'rating']], reader)
-    trainset = data.build_full_trainset()
-    
-    collab_model = SVD(
-        n_factors=50,
-        n_epochs=20,
-        lr_all=0.003,
-        reg_all=0.05,
-        random_state=42
+# Load collaborative model (factor arrays are memory-mapped read-only).
+# Training happens offline in train.py so workers never train at startup.
+collab_model = load_model(model_path, mmap_mode='r')
+if collab_model is None:
+    raise FileNotFoundError(f"Collaborative model not found at: {model_path} (run: python train.py)")
+logger.info("Collaborative model loaded successfully")
+
+# Factor row of every catalog anime (-1 if unseen in training), aligned with df rows
+catalog_item_index = index_of(collab_model.anime_ids, df['anime_id'].to_numpy())
+
+# Optionally precompute every user/item prediction (needs users x items float32 of RAM)
+if os.environ.get('PRECOMPUTE_PREDICTIONS', '').lower() in ('1', 'true', 'yes'):
+    prediction_table = build_prediction_table(collab_model)
+else:
+    prediction_table = None
+
+# Freeze load-time arrays so forked workers only ever read the shared pages
+for shared_array in (
+    similarity_matrix.unit,
+    top_k_table,
+    top_k_scores,
+    popularity_order,
+    prediction_table,
+    catalog_item_index,
+    *type_masks.values(),
+    user_item_matrix.user_ids,
+    user_item_matrix.anime_ids,
+    user_item_matrix.matrix.indptr,
+    user_item_matrix.matrix.indices,
+):
+    if isinstance(shared_array, np.ndarray) and shared_array.flags.writeable:
+        shared_array.setflags(write=False)
+
+def single_flight(func, lock_timeout=10, poll_interval=0.05):
+    """Compute a cache miss once: concurrent calls with the same arguments wait for the first.
+
+    func must be cache.memoize'd. Warm hits are read straight from its entry and
+    never touch the lock. On a miss the lock is a cache.add() marker, which is
+    atomic in Redis, so it also holds across gunicorn workers. The memoized call
+    re-checks the entry after the lock is taken; waiters retry once it is
+    released (hitting the entry the first caller stored) or after lock_timeout.
+    """
+    @wraps(func)
+    def wrapper(*args):
+        cache_key = func.make_cache_key(func.uncached, *args)
+        value = cache.get(cache_key)
+        if value is not None:
+            return value
+        lock_key = f"lock:{cache_key}"
+        if not cache.add(lock_key, 1, timeout=lock_timeout):
+            deadline = time.monotonic() + lock_timeout
+            while cache.get(lock_key) is not None and time.monotonic() < deadline:
+                time.sleep(poll_interval)
+            return func(*args)
+        try:
+            return func(*args)
+        finally:
+            cache.delete(lock_key)
+    return wrapper
+
+# Memoized recommenders shared by the single-method and hybrid endpoints.
+# Arguments are normalized by the callers so equivalent requests share entries.
+
+@single_flight
+@cache.memoize(timeout=CACHE_TIMEOUT)
+def cached_content_recommendations(title, n, anime_type):
+    """Content-based recommendations as a list of records ([] if none found)"""
+    recommendations = get_recommendations(
+        title, df, similarity_matrix, n, anime_type, title_index, top_k_table, type_masks, top_k_scores
     )
-    collab_model.fit(trainset)
-    pickle.dump(collab_model, open('collab_model.pkl', 'wb'))
-    logger.info("New collaborative model trained and saved")
+    if recommendations is None or recommendations.empty:
+        return []
+    return recommendations.to_dict('records')
+
+@lru_cache(maxsize=CONFIG['user_prediction_cache_size'])
+def catalog_predictions_for(user_id):
+    """Read-only predicted rating of every catalog row for a user, shared by all n/type variants"""
+    predictions = predict_item_ratings(collab_model, user_id, catalog_item_index, prediction_table)
+    predictions.setflags(write=False)
+    return predictions
+
+@single_flight
+@cache.memoize(timeout=CACHE_TIMEOUT)
+def cached_collab_top(user_id, anime_type):
+    """A user's MAX_N best collaborative recommendations; any smaller n is a prefix of this list"""
+    # Users without ratings get popular anime, so there is nothing to predict
+    has_ratings = len(user_item_matrix.rated_anime(user_id)) > 0
+    return get_collab_recommendations(
+        user_id, collab_model, df, user_item_matrix, MAX_N, anime_type, prediction_table, catalog_item_index,
+        catalog_predictions_for(user_id) if has_ratings else None, type_masks, popularity_order
+    )
+
+def cached_collab_recommendations(user_id, n, anime_type):
+    """Collaborative filtering recommendations for a user, sliced from one shared cache entry per user/type"""
+    return cached_collab_top(user_id, anime_type)[:n]
+
+# Runs the collaborative half of a hybrid request while the content half runs
+# on the request thread (threads start lazily, so each worker gets its own)
+hybrid_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='hybrid')
 
 # Recommendation Endpoints
 
 @app.route('/recommend/content', methods=['GET'])
-@cache.cached(timeout=CONFIG['cache_timeout'], query_string=True)
+@cache.cached(timeout=CACHE_TIMEOUT, key_prefix=recommendation_cache_key)
 def content_based():
     """Content-based recommendation endpoint with type filtering"""
-    title = request.args.get('title', default='', type=str)
-    n = request.args.get('n', default=CONFIG['default_recommendations'], type=int)
-    anime_type = request.args.get('type', default='all', type=str)
-    n = validate_n_parameter(n)
+    title, _, n, anime_type = recommendation_args()
 
     # Validation
     if not title:
         return jsonify({"error": "Title parameter is required"}), 400
-    if len(title.strip()) < 2:
+    if len(title) < 2:
         return jsonify({"error": "Title must be at least 2 characters"}), 400
 
     try:
-        recommendations = get_recommendations(title, df, similarity_matrix, n, anime_type)
-        if recommendations is None or recommendations.empty:
+        recommendations = cached_content_recommendations(title.lower(), n, anime_type)
+        if not recommendations:
             return jsonify({"error": "No recommendations found"}), 404
         
         # Ensure we return exactly n recommendations (or less if not enough available)
-        recommendations = recommendations.head(n)
-        return jsonify(recommendations.to_dict('records'))
+        recommendations = recommendations[:n]
+        return jsonify(recommendations)
     except Exception as e:
         logger.error(f"Content-based recommendation failed: {str(e)}", exc_info=True)
         return jsonify({"error": "Internal server error"}), 500
 
 @app.route('/recommend/collab', methods=['GET'])
 @app.route('/recommend/collaborative', methods=['GET'])
-@cache.cached(timeout=CONFIG['cache_timeout'], query_string=True)
+@cache.cached(timeout=CACHE_TIMEOUT, key_prefix=recommendation_cache_key)
 def collab_based():
     """Collaborative filtering recommendation endpoint with type filtering"""
-    user_id = request.args.get('user_id', type=int)
-    n = request.args.get('n', default=CONFIG['default_recommendations'], type=int)
-    anime_type = request.args.get('type', default='all', type=str)
-    n = validate_n_parameter(n)
+    _, user_id, n, anime_type = recommendation_args()
 
     if user_id is None:
         return jsonify({"error": "user_id parameter is required"}), 400
     
-    if not isinstance(user_id, int) or user_id < 1:
+    if user_id < 1:
         return jsonify({"error": "user_id must be a positive integer"}), 400
 
     try:
-        recommendations = get_collab_recommendations(user_id, collab_model, df, ratings_df, n, anime_type)
+        recommendations = cached_collab_recommendations(user_id, n, anime_type)
         if not recommendations:
             return jsonify({"error": "No recommendations found"}), 404
         
@@ -238,31 +449,27 @@ def collab_based():
 
 # backend/app.py
 @app.route('/recommend/hybrid', methods=['GET'])
-@cache.cached(timeout=CONFIG['cache_timeout'], query_string=True)
+@cache.cached(timeout=CACHE_TIMEOUT, key_prefix=recommendation_cache_key)
 def hybrid_based():
     """Hybrid recommendation endpoint combining content and collaborative filtering with type filtering"""
     try:
-        title = request.args.get('title', default='', type=str)
-        user_id = request.args.get('user_id', type=int)
-        n = request.args.get('n', default=CONFIG['default_recommendations'], type=int)
-        anime_type = request.args.get('type', default='all', type=str)
-        n = validate_n_parameter(n)
+        title, user_id, n, anime_type = recommendation_args()
 
         # Validation
-        if not title or len(title.strip()) < 2:
+        if len(title) < 2:
             return jsonify({"error": "Title must be at least 2 characters"}), 400
         if not user_id or user_id < 1:
             return jsonify({"error": "Valid user_id is required"}), 400
 
-        # Get content-based recommendations (fetch more to allow for merging)
+        # Fetch more than n from both methods to allow for merging; the
+        # collaborative half runs concurrently with the content half
         fetch_multiplier = max(2, n // 2)  # Fetch at least 2x the requested amount
-        content_fetch_n = min(n * fetch_multiplier, CONFIG['max_recommendations'])
-        content_recs_df = get_recommendations(title, df, similarity_matrix, content_fetch_n, anime_type)
-        content_list = content_recs_df.to_dict('records') if not content_recs_df.empty else []
-
-        # Get collaborative recommendations (fetch more to allow for merging)
-        collab_fetch_n = min(n * fetch_multiplier, CONFIG['max_recommendations'])
-        collab_list = get_collab_recommendations(user_id, collab_model, df, ratings_df, collab_fetch_n, anime_type)
+        fetch_n = min(n * fetch_multiplier, MAX_N)
+        collab_future = hybrid_executor.submit(
+            copy_current_request_context(cached_collab_recommendations), user_id, fetch_n, anime_type
+        )
+        content_list = cached_content_recommendations(title.lower(), fetch_n, anime_type)
+        collab_list = collab_future.result()
 
         # Merge into hybrid using the duplicate-free, hybrid-first logic
         hybrid_results = merge_recommendations(content_list, collab_list, n)
@@ -286,30 +493,37 @@ def hybrid_based():
 @app.route('/recommend/random', methods=['GET'])
 def random_recommendations():
     """Random anime recommendations endpoint with type filtering"""
-    n = request.args.get('n', default=CONFIG['default_recommendations'], type=int)
-    anime_type = request.args.get('type', default='all', type=str)
-    n = validate_n_parameter(n)
+    _, _, n, anime_type = recommendation_args()
     
     try:
-        # Apply type filtering first
-        filtered_df = filter_by_type(df, anime_type)
+        # Apply type filtering first, as row positions rather than a filtered copy
+        mask = type_mask(df, anime_type, type_masks)
+        positions = np.arange(len(df)) if mask is None else np.flatnonzero(mask)
         
-        if filtered_df.empty:
+        if len(positions) == 0:
             return jsonify({"error": f"No anime found for type: {anime_type}"}), 404
         
-        # Get fresh random sample without replacement
-        available_anime = min(n, len(filtered_df))
-        random_sample = filtered_df.sample(n=available_anime, replace=False)
+        # Get fresh random sample without replacement (a new OS-seeded generator per
+        # request, so forked workers don't share a random stream)
+        available_anime = min(n, len(positions))
+        chosen = np.random.default_rng().choice(positions, size=available_anime, replace=False)
+        random_sample = df.iloc[chosen]
         
-        recommendations = []
-        for _, row in random_sample.iterrows():
-            recommendations.append({
-                'Anime': row['name'],
-                'Genres': row['genre'],
-                'Rating': float(row['rating']) if pd.notna(row['rating']) else 0.0,
-                'Type': row['type'],
-                'Members': int(row['members']) if pd.notna(row['members']) else 0
+        recommendations = (
+            random_sample[['name', 'genre', 'rating', 'type', 'members']]
+            .assign(
+                rating=lambda d: d['rating'].fillna(0.0).astype(float),
+                members=lambda d: d['members'].fillna(0).astype(int)
+            )
+            .rename(columns={
+                'name': 'Anime',
+                'genre': 'Genres',
+                'rating': 'Rating',
+                'type': 'Type',
+                'members': 'Members'
             })
+            .to_dict('records')
+        )
         
         # Add cache-control headers to prevent any caching
         response = jsonify(recommendations)
@@ -342,6 +556,10 @@ def get_available_types():
         logger.error(f"Failed to get available types: {str(e)}")
         return jsonify({"error": "Internal server error"}), 500
 
+# Hybrid pool method codes, in the priority order merge_recommendations fills results
+HYBRID, CONTENT, COLLAB = 0, 1, 2
+METHOD_NAMES = ('hybrid', 'content', 'collab')
+
 def merge_recommendations(content_recs, collab_recs, target_n=None):
     """
     Merge content-based and collaborative recommendations into a hybrid list.
@@ -355,145 +573,125 @@ def merge_recommendations(content_recs, collab_recs, target_n=None):
         List of merged recommendations
     """
     if target_n is None:
-        target_n = CONFIG['default_recommendations']
+        target_n = DEFAULT_N
+    content_weight = CONFIG['content_weight']
+    collab_weight = CONFIG['collab_weight']
     
     if not content_recs and not collab_recs:
         return []
 
-    hybrid = []
-    anime_scores = {}
+    # Candidate pool as parallel arrays; position maps each anime to its slot
+    position = {}
+    names, genre_lists, genre_masks, content_data, collab_data = [], [], [], [], []
+    content_scores, collab_scores = [], []
+
+    def set_slot(anime, content_score, collab_score, genres, content_item, collab_item):
+        i = position.get(anime)
+        if i is None:
+            position[anime] = len(names)
+            names.append(anime)
+            for column in (content_scores, collab_scores, genre_lists, genre_masks, content_data, collab_data):
+                column.append(None)
+            i = len(names) - 1
+        content_scores[i] = content_score
+        collab_scores[i] = collab_score
+        genre_lists[i] = genres
+        genre_masks[i] = genre_mask(genres)
+        content_data[i] = content_item
+        collab_data[i] = collab_item
 
     # Step 1: Process content recommendations
     for item in content_recs:
-        anime = item['Anime']
         content_score = float(item.get('Similarity Score', item.get('Content_Score', 0)))
-        anime_scores[anime] = {
-            'content_score': content_score,
-            'collab_score': 0,
-            'genres': set(item.get('Genres', [])),
-            'content_data': item,
-            'collab_data': None
-        }
+        set_slot(item['Anime'], content_score, 0, item.get('Genres', []), item, None)
 
     # Step 2: Process collaborative recommendations
     for item in collab_recs:
         anime = item['Anime']
         collab_score = float(item.get('Collab_Score', item.get('Predicted Rating', 0)) / 10 if item.get('Predicted Rating', 0) > 1 else item.get('Collab_Score', item.get('Predicted Rating', 0)))
         
-        if anime in anime_scores:
-            # Anime appears in both - calculate genre bonus
-            content_genres = anime_scores[anime]['genres']
-            collab_genres = set(item.get('Genres', []))
-            genre_bonus = len(content_genres & collab_genres) / len(content_genres | collab_genres) * 0.1 if content_genres | collab_genres else 0
-            anime_scores[anime]['collab_score'] = collab_score + genre_bonus
-            anime_scores[anime]['collab_data'] = item
+        i = position.get(anime)
+        if i is not None:
+            # Anime appears in both - calculate genre bonus (Jaccard over genre bitmasks)
+            content_mask = genre_masks[i]
+            collab_mask = genre_mask(item.get('Genres', []))
+            union = (content_mask | collab_mask).bit_count()
+            genre_bonus = (content_mask & collab_mask).bit_count() / union * 0.1 if union else 0
+            collab_scores[i] = collab_score + genre_bonus
+            collab_data[i] = item
         else:
             # Collab-only anime
-            anime_scores[anime] = {
-                'content_score': 0,
-                'collab_score': collab_score,
-                'genres': set(item.get('Genres', [])),
-                'content_data': None,
-                'collab_data': item
-            }
-
-    # Step 3: Percentile normalization for fair comparison
-    content_values = [s['content_score'] for s in anime_scores.values() if s['content_score'] > 0]
-    collab_values = [s['collab_score'] for s in anime_scores.values() if s['collab_score'] > 0]
+            set_slot(anime, 0, collab_score, item.get('Genres', []), None, item)
 
-    def percentile_rank(score, all_scores):
-        if not all_scores or score <= 0:
-            return 0
-        sorted_scores = sorted(all_scores)
-        try:
-            index = sorted_scores.index(score)
-            return index / (len(sorted_scores) - 1) if len(sorted_scores) > 1 else 1.0
-        except ValueError:
-            # Handle case where score is not exactly in the list
-            for i, s in enumerate(sorted_scores):
-                if s >= score:
-                    return i / (len(sorted_scores) - 1) if len(sorted_scores) > 1 else 1.0
-            return 1.0
+    content_scores = np.array(content_scores, dtype=np.float64)
+    collab_scores = np.array(collab_scores, dtype=np.float64)
 
-    # Step 4: Compute combined scores and create result objects
-    for anime, scores in anime_scores.items():
-        content_pct = percentile_rank(scores['content_score'], content_values) if scores['content_score'] > 0 else 0
-        collab_pct = percentile_rank(scores['collab_score'], collab_values) if scores['collab_score'] > 0 else 0
+    # Step 3: Percentile normalization for fair comparison
+    def percentile_ranks(scores):
+        """First-tie rank of each positive score among the positive ones, scaled to 0-1 (0 if not positive)"""
+        positive = scores > 0
+        sorted_scores = np.sort(scores[positive])
+        ranks = np.zeros(len(scores), dtype=np.float64)
+        if len(sorted_scores) > 1:
+            ranks[positive] = np.searchsorted(sorted_scores, scores[positive], side='left') / (len(sorted_scores) - 1)
+        elif len(sorted_scores) == 1:
+            ranks[positive] = 1.0
+        return ranks
+
+    # Step 4: Combined scores and method codes for the whole pool at once
+    content_pct = percentile_ranks(content_scores)
+    collab_pct = percentile_ranks(collab_scores)
+    combined = content_pct * content_weight + collab_pct * collab_weight
+    combined_rounded = [round(score, 3) for score in combined.tolist()]
+    method_code = np.where(content_pct > 0, np.where(collab_pct > 0, HYBRID, CONTENT), COLLAB)
+
+    # Steps 5-6: One stable ordering by priority bucket (hybrid, content, collab),
+    # then by combined score, ties keeping pool order
+    priority = np.lexsort((-np.array(combined_rounded), method_code))
+    n_final = min(target_n, len(priority))
+    final_hybrid = priority[:n_final].tolist()
 
-        combined = content_pct * CONFIG['content_weight'] + collab_pct * CONFIG['collab_weight']
+    # Step 7: Ensure minimum diversity - at least 2 collab items if available
+    n_collab = int(np.count_nonzero(method_code == COLLAB))
+    collab_start = len(priority) - n_collab  # collab items are the tail of the ordering
+    current_collab_count = max(0, n_final - collab_start)
+    min_collab = min(2, n_collab, target_n // 3)  # At least 2 or 1/3 of results, whichever is smaller
+    
+    if current_collab_count < min_collab:
+        # Replace the lowest scoring non-collab items with the next best collab items
+        needed = min_collab - current_collab_count
+        final_hybrid = (
+            priority[:n_final - current_collab_count - needed].tolist()
+            + priority[collab_start:collab_start + min_collab].tolist()
+        )
 
-        # Determine method
-        method = 'hybrid' if content_pct > 0 and collab_pct > 0 else 'content' if content_pct > 0 else 'collab'
+    # Final sort by combined score
+    final_hybrid.sort(key=combined_rounded.__getitem__, reverse=True)
+    final_hybrid = final_hybrid[:target_n]
 
+    # Step 8: Build records with genres and method-specific data (including type) for the returned items only
+    results = []
+    for i in final_hybrid:
         result = {
-            'Anime': anime,
-            'Combined_Score': round(combined, 3),
-            'Method': method,
-            'Genres': list(scores['genres'])
+            'Anime': names[i],
+            'Combined_Score': combined_rounded[i],
+            'Method': METHOD_NAMES[method_code[i]],
+            'Genres': list(dict.fromkeys(genre_lists[i]))
         }
-
-        # Add method-specific data including type
-        if scores['content_data']:
+        if content_data[i]:
             result.update({
-                'Similarity_Score': scores['content_data'].get('Similarity Score'),
-                'Content_Rating': scores['content_data'].get('Rating'),
-                'Type': scores['content_data'].get('Type')
+                'Similarity_Score': content_data[i].get('Similarity Score'),
+                'Content_Rating': content_data[i].get('Rating'),
+                'Type': content_data[i].get('Type')
             })
-        if scores['collab_data']:
+        if collab_data[i]:
             result.update({
-                'Predicted_Rating': scores['collab_data'].get('Predicted Rating'),
-                'Type': scores['collab_data'].get('Type')
+                'Predicted_Rating': collab_data[i].get('Predicted Rating'),
+                'Type': collab_data[i].get('Type')
             })
-
-        hybrid.append(result)
-
-    # Step 5: Sort by combined score
-    hybrid_sorted = sorted(hybrid, key=lambda x: x['Combined_Score'], reverse=True)
-
-    # Step 6: Ensure diversity and enforce constraints
-    final_hybrid = []
-    seen = set()
-    
-    # Separate by method type
-    hybrid_items = [h for h in hybrid_sorted if h['Method'] == 'hybrid']
-    content_items = [h for h in hybrid_sorted if h['Method'] == 'content']  
-    collab_items = [h for h in hybrid_sorted if h['Method'] == 'collab']
-
-    # Add items in priority order: hybrid first, then content, then collab
-    for item_list in [hybrid_items, content_items, collab_items]:
-        for item in item_list:
-            if len(final_hybrid) >= target_n:
-                break
-            if item['Anime'] not in seen:
-                final_hybrid.append(item)
-                seen.add(item['Anime'])
-        if len(final_hybrid) >= target_n:
-            break
-
-    # Step 7: Ensure minimum diversity - at least 2 collab items if available
-    current_collab_count = len([h for h in final_hybrid if h['Method'] == 'collab'])
-    min_collab = min(2, len(collab_items), target_n // 3)  # At least 2 or 1/3 of results, whichever is smaller
-    
-    if current_collab_count < min_collab:
-        needed = min_collab - current_collab_count
-        available_collab = [item for item in collab_items if item['Anime'] not in seen]
-        
-        # Replace lowest scoring non-collab items with collab items
-        for i in range(min(needed, len(available_collab))):
-            if len(final_hybrid) > min_collab:
-                # Remove lowest scoring non-collab item
-                for j in range(len(final_hybrid) - 1, -1, -1):
-                    if final_hybrid[j]['Method'] != 'collab':
-                        final_hybrid.pop(j)
-                        break
-            
-            final_hybrid.append(available_collab[i])
-            seen.add(available_collab[i]['Anime'])
-
-    # Final sort by combined score
-    final_hybrid.sort(key=lambda x: x['Combined_Score'], reverse=True)
+        results.append(result)
     
-    return final_hybrid[:target_n]
+    return results
 
 @app.route('/health', methods=['GET'])
 def health_check():
@@ -509,4 +707,5 @@ def health_check():
 
 if __name__ == '__main__':
     logger.info(f"Starting Flask app with config: {CONFIG}")
-    app.run(debug=True, port=5000)
\ No newline at end of file
+    # Development server only; the debug reloader would load all data twice, so it is opt-in
+    app.run(debug=os.environ.get('FLASK_DEBUG', '').lower() in ('1', 'true', 'yes'), port=5000)
\ No newline at end of file
@@ -1,6 +1,9 @@
 # backend/auth.py
 import os
 import jwt
+import time
+import hashlib
+import threading
 import requests
 from functools import wraps
 from flask import request, jsonify, current_app
@@ -13,6 +16,39 @@ SUPABASE_URL = os.getenv('SUPABASE_URL')
 SUPABASE_JWT_SECRET = os.getenv('SUPABASE_JWT_SECRET')
 SUPABASE_SERVICE_KEY = os.getenv('SUPABASE_SERVICE_KEY')
 
+# Verified token payloads keyed by a digest of the raw token, each kept until
+# the token's own exp claim so a reused bearer token is only verified once
+TOKEN_CACHE_SIZE = 4096
+_token_cache = {}
+_token_cache_lock = threading.Lock()
+
+def _cached_token_payload(key):
+    """Payload of a previously verified, still unexpired token (or None)"""
+    with _token_cache_lock:
+        entry = _token_cache.get(key)
+        if entry is None:
+            return None
+        expires_at, payload = entry
+        if expires_at <= time.time():
+            del _token_cache[key]
+            return None
+    return dict(payload)
+
+def _cache_token_payload(key, payload):
+    """Remember a verified payload until its exp claim; tokens without one are not cached"""
+    expires_at = payload.get('exp')
+    if not isinstance(expires_at, (int, float)) or expires_at <= time.time():
+        return
+    with _token_cache_lock:
+        if len(_token_cache) >= TOKEN_CACHE_SIZE:
+            now = time.time()
+            for expired in [k for k, (exp, _) in _token_cache.items() if exp <= now]:
+                del _token_cache[expired]
+            if len(_token_cache) >= TOKEN_CACHE_SIZE:
+                # Still full: drop the oldest entry
+                del _token_cache[next(iter(_token_cache))]
+        _token_cache[key] = (expires_at, dict(payload))
+
 def verify_supabase_token(token):
     """Verify Supabase JWT token and extract user info"""
     try:
@@ -29,6 +65,12 @@ def verify_supabase_token(token):
             # Extract user ID from token (assuming it's formatted as user_id)
             return {'sub': token, 'email': f'user-{token}@example.com'}
         
+        # Tokens are reused for their whole lifetime, so skip re-verifying known ones
+        cache_key = hashlib.blake2b(token.encode(), digest_size=16).digest()
+        payload = _cached_token_payload(cache_key)
+        if payload is not None:
+            return payload
+        
         # Decode and verify the JWT token using Supabase's JWT secret
         payload = jwt.decode(
             token,
@@ -37,6 +79,7 @@ def verify_supabase_token(token):
             audience="authenticated",
             options={"verify_aud": False}  # Supabase tokens might not have proper audience
         )
+        _cache_token_payload(cache_key, payload)
         
         return payload
         
@@ -87,55 +130,121 @@ def auth_optional(f):
 
 # backend/user_service.py
 import pandas as pd
+import os
+import queue
 import sqlite3
 import json
+import orjson
+import threading
+from collections import Counter
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Applied to every pooled connection: WAL lets readers run alongside the writer
+SQLITE_PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA cache_size=-64000',
+)
+
+# Shared by the single and bulk writers, so each connection's statement cache
+# holds one prepared statement for both
+INSERT_PREFERENCE_SQL = '''
+    INSERT OR REPLACE INTO user_preferences 
+    (user_id, anime_name, action, value, genres)
+    VALUES (?, ?, ?, ?, ?)
+'''
+
 class UserService:
-    def __init__(self, db_path='user_data.db'):
+    def __init__(self, db_path='user_data.db', pool_size=4):
         self.db_path = db_path
+        self.pool_size = pool_size
+        self._pool_lock = threading.Lock()
+        self._reset_pool()
         self.init_database()
     
+    def _reset_pool(self):
+        """Start an empty connection pool owned by the current process"""
+        self._pool = queue.Queue()
+        self._opened = 0
+        self._pool_pid = os.getpid()
+    
+    def _connect(self):
+        """Open a connection that any thread may use and tune it once
+
+        Each pooled connection keeps its own cache of prepared statements, so
+        constant SQL texts like INSERT_PREFERENCE_SQL compile once per connection.
+        """
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, cached_statements=256)
+        for pragma in SQLITE_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+    
+    @contextmanager
+    def _conn(self):
+        """Borrow a pooled connection; at most pool_size are opened per process"""
+        conn = None
+        with self._pool_lock:
+            # Connections must not cross a fork, so a child starts its own pool
+            if self._pool_pid != os.getpid():
+                self._reset_pool()
+            pool = self._pool
+            try:
+                conn = pool.get_nowait()
+            except queue.Empty:
+                if self._opened < self.pool_size:
+                    conn = self._connect()
+                    self._opened += 1
+        if conn is None:
+            conn = pool.get()
+        
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            pool.put(conn)
+    
     def init_database(self):
         """Initialize SQLite database for user data"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # User preferences table
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS user_preferences (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id TEXT NOT NULL,
-                    anime_name TEXT NOT NULL,
-                    action TEXT NOT NULL, -- 'like', 'dislike', 'rating'
-                    value REAL, -- rating value if applicable
-                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    genres TEXT, -- JSON array of genres
-                    UNIQUE(user_id, anime_name, action)
-                )
-            ''')
-            
-            # User stats table
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS user_stats (
-                    user_id TEXT PRIMARY KEY,
-                    total_ratings INTEGER DEFAULT 0,
-                    average_rating REAL DEFAULT 0,
-                    favorite_genres TEXT, -- JSON array
-                    total_favorites INTEGER DEFAULT 0,
-                    total_watchlist INTEGER DEFAULT 0,
-                    recommendation_accuracy REAL DEFAULT 0,
-                    last_updated DATETIME DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            conn.commit()
-            conn.close()
+            with self._conn() as conn:
+                cursor = conn.cursor()
+                
+                # User preferences table
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS user_preferences (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        user_id TEXT NOT NULL,
+                        anime_name TEXT NOT NULL,
+                        action TEXT NOT NULL, -- 'like', 'dislike', 'rating'
+                        value REAL, -- rating value if applicable
+                        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                        genres TEXT, -- JSON array of genres
+                        UNIQUE(user_id, anime_name, action)
+                    )
+                ''')
+                
+                # User stats table
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS user_stats (
+                        user_id TEXT PRIMARY KEY,
+                        total_ratings INTEGER DEFAULT 0,
+                        average_rating REAL DEFAULT 0,
+                        favorite_genres TEXT, -- JSON array
+                        total_favorites INTEGER DEFAULT 0,
+                        total_watchlist INTEGER DEFAULT 0,
+                        recommendation_accuracy REAL DEFAULT 0,
+                        last_updated DATETIME DEFAULT CURRENT_TIMESTAMP
+                    )
+                ''')
+                
+                conn.commit()
             logger.info("User database initialized successfully")
             
         except Exception as e:
@@ -144,22 +253,13 @@ class UserService:
     def add_user_preference(self, user_id: str, anime_name: str, action: str, value: Optional[float] = None, genres: Optional[List[str]] = None):
         """Add or update user preference"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
             genres_json = json.dumps(genres) if genres else None
             
-            cursor.execute('''
-                INSERT OR REPLACE INTO user_preferences 
-                (user_id, anime_name, action, value, genres)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (user_id, anime_name, action, value, genres_json))
-            
-            conn.commit()
-            conn.close()
-            
-            # Update user stats
-            self.update_user_stats(user_id)
+            # Insert and refresh the user's stats in one transaction
+            with self._conn() as conn:
+                conn.execute(INSERT_PREFERENCE_SQL, (user_id, anime_name, action, value, genres_json))
+                self._write_user_stats(conn, user_id)
+                conn.commit()
             
             logger.info(f"Added preference for user {user_id}: {action} {anime_name}")
             return True
@@ -168,35 +268,59 @@ class UserService:
             logger.error(f"Failed to add user preference: {str(e)}")
             return False
     
+    def add_user_preferences_bulk(self, user_id: str, items: List[tuple]):
+        """Add or update many (anime_name, action, value, genres) preferences at once
+
+        All rows are written with one executemany in a single transaction and the
+        user's stats are recomputed once at the end.
+        """
+        try:
+            rows = [
+                (user_id, anime_name, action, value, json.dumps(genres) if genres else None)
+                for anime_name, action, value, genres in items
+            ]
+            
+            with self._conn() as conn:
+                conn.executemany(INSERT_PREFERENCE_SQL, rows)
+                self._write_user_stats(conn, user_id)
+                conn.commit()
+            
+            logger.info(f"Added {len(rows)} preferences for user {user_id}")
+            return True
+            
+        except Exception as e:
+            logger.error(f"Failed to add user preferences: {str(e)}")
+            return False
+    
     def get_user_preferences(self, user_id: str, action: Optional[str] = None) -> List[Dict]:
         """Get user preferences, optionally filtered by action"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            if action:
-                cursor.execute('''
-                    SELECT * FROM user_preferences 
-                    WHERE user_id = ? AND action = ?
-                    ORDER BY timestamp DESC
-                ''', (user_id, action))
-            else:
-                cursor.execute('''
-                    SELECT * FROM user_preferences 
-                    WHERE user_id = ?
-                    ORDER BY timestamp DESC
-                ''', (user_id,))
+            with self._conn() as conn:
+                cursor = conn.cursor()
+                
+                if action:
+                    cursor.execute('''
+                        SELECT * FROM user_preferences 
+                        WHERE user_id = ? AND action = ?
+                        ORDER BY timestamp DESC
+                    ''', (user_id, action))
+                else:
+                    cursor.execute('''
+                        SELECT * FROM user_preferences 
+                        WHERE user_id = ?
+                        ORDER BY timestamp DESC
+                    ''', (user_id,))
+                
+                columns = [desc[0] for desc in cursor.description]
+                rows = cursor.fetchall()
             
-            columns = [desc[0] for desc in cursor.description]
             preferences = []
-            
-            for row in cursor.fetchall():
+            for row in rows:
                 pref = dict(zip(columns, row))
                 if pref['genres']:
-                    pref['genres'] = json.loads(pref['genres'])
+                    pref['genres'] = orjson.loads(pref['genres'])
                 preferences.append(pref)
             
-            conn.close()
             return preferences
             
         except Exception as e:
@@ -206,14 +330,13 @@ class UserService:
     def get_user_stats(self, user_id: str) -> Dict:
         """Get user statistics"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('SELECT * FROM user_stats WHERE user_id = ?', (user_id,))
-            result = cursor.fetchone()
+            with self._conn() as conn:
+                cursor = conn.execute('SELECT * FROM user_stats WHERE user_id = ?', (user_id,))
+                result = cursor.fetchone()
+                columns = [desc[0] for desc in cursor.description]
             
             if not result:
-                # Create default stats
+                # Create default stats (after handing the connection back to the pool)
                 default_stats = {
                     'total_ratings': 0,
                     'average_rating': 0,
@@ -223,18 +346,15 @@ class UserService:
                     'recommendation_accuracy': 0
                 }
                 self.update_user_stats(user_id)
-                conn.close()
                 return default_stats
             
-            columns = [desc[0] for desc in cursor.description]
             stats = dict(zip(columns, result))
             
             if stats['favorite_genres']:
-                stats['favorite_genres'] = json.loads(stats['favorite_genres'])
+                stats['favorite_genres'] = orjson.loads(stats['favorite_genres'])
             else:
                 stats['favorite_genres'] = []
             
-            conn.close()
             return stats
             
         except Exception as e:
@@ -244,84 +364,90 @@ class UserService:
     def update_user_stats(self, user_id: str):
         """Update calculated user statistics"""
         try:
-            preferences = self.get_user_preferences(user_id)
-            
-            # Calculate stats
-            ratings = [p for p in preferences if p['action'] == 'rating' and p['value']]
-            likes = [p for p in preferences if p['action'] == 'like']
-            
-            total_ratings = len(ratings)
-            average_rating = sum(r['value'] for r in ratings) / total_ratings if ratings else 0
-            total_favorites = len(likes)
-            
-            # Calculate favorite genres
-            all_genres = []
-            for pref in preferences:
-                if pref.get('genres'):
-                    all_genres.extend(pref['genres'])
-            
-            genre_counts = {}
-            for genre in all_genres:
-                genre_counts[genre] = genre_counts.get(genre, 0) + 1
-            
-            favorite_genres = sorted(genre_counts.items(), key=lambda x: x[1], reverse=True)[:5]
-            favorite_genres = [genre for genre, count in favorite_genres]
-            
-            # Update database
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                INSERT OR REPLACE INTO user_stats 
-                (user_id, total_ratings, average_rating, favorite_genres, total_favorites, total_watchlist, recommendation_accuracy)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                user_id,
-                total_ratings,
-                average_rating,
-                json.dumps(favorite_genres),
-                total_favorites,
-                0,  # total_watchlist - not implemented yet
-                85.3  # recommendation_accuracy - mock value
-            ))
-            
-            conn.commit()
-            conn.close()
+            with self._conn() as conn:
+                self._write_user_stats(conn, user_id)
+                conn.commit()
             
         except Exception as e:
             logger.error(f"Failed to update user stats: {str(e)}")
     
+    def _write_user_stats(self, conn, user_id: str):
+        """Recompute a user's stats row on conn, inside the caller's transaction"""
+        # Calculate counts and the average rating in one pass inside SQLite
+        total_ratings, average_rating, total_favorites = conn.execute('''
+            SELECT
+                COUNT(CASE WHEN action = 'rating' AND value != 0 THEN 1 END),
+                AVG(CASE WHEN action = 'rating' AND value != 0 THEN value END),
+                COUNT(CASE WHEN action = 'like' THEN 1 END)
+            FROM user_preferences
+            WHERE user_id = ?
+        ''', (user_id,)).fetchone()
+        average_rating = average_rating or 0
+        
+        # Calculate favorite genres (most recent preferences first on ties)
+        genre_counts = Counter(
+            genre
+            for (genres,) in conn.execute('''
+                SELECT genres FROM user_preferences
+                WHERE user_id = ? AND genres IS NOT NULL
+                ORDER BY timestamp DESC
+            ''', (user_id,))
+            for genre in orjson.loads(genres)
+        )
+        favorite_genres = [genre for genre, count in genre_counts.most_common(5)]
+        
+        # Update database
+        conn.execute('''
+            INSERT OR REPLACE INTO user_stats 
+            (user_id, total_ratings, average_rating, favorite_genres, total_favorites, total_watchlist, recommendation_accuracy)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (
+            user_id,
+            total_ratings,
+            average_rating,
+            json.dumps(favorite_genres),
+            total_favorites,
+            0,  # total_watchlist - not implemented yet
+            85.3  # recommendation_accuracy - mock value
+        ))
+    
     def get_recent_activity(self, user_id: str, limit: int = 10) -> List[Dict]:
         """Get recent user activity"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                SELECT anime_name, action, value, timestamp, genres
-                FROM user_preferences 
-                WHERE user_id = ?
-                ORDER BY timestamp DESC
-                LIMIT ?
-            ''', (user_id, limit))
-            
-            activities = []
-            for row in cursor.fetchall():
-                activity = {
-                    'anime_name': row[0],
-                    'action': row[1],
-                    'value': row[2],
-                    'timestamp': row[3],
-                    'genres': json.loads(row[4]) if row[4] else []
+            with self._conn() as conn:
+                rows = conn.execute('''
+                    SELECT anime_name, action, value, timestamp, genres
+                    FROM user_preferences 
+                    WHERE user_id = ?
+                    ORDER BY timestamp DESC
+                    LIMIT ?
+                ''', (user_id, limit)).fetchall()
+            
+            return [
+                {
+                    'anime_name': anime_name,
+                    'action': action,
+                    'value': value,
+                    'timestamp': timestamp,
+                    'genres': orjson.loads(genres) if genres else []
                 }
-                activities.append(activity)
-            
-            conn.close()
-            return activities
+                for anime_name, action, value, timestamp, genres in rows
+            ]
             
         except Exception as e:
             logger.error(f"Failed to get recent activity: {str(e)}")
             return []
 
-# Initialize user service
-user_service = UserService()
\ No newline at end of file
+# Shared user service, created on first use so importing this module never
+# opens the database (e.g. in workers that don't touch user data)
+_user_service = None
+_user_service_lock = threading.Lock()
+
+def get_user_service():
+    """Return the shared UserService, initializing it on the first call"""
+    global _user_service
+    if _user_service is None:
+        with _user_service_lock:
+            if _user_service is None:
+                _user_service = UserService()
+    return _user_service
@@ -0,0 +1,16 @@
+# backend/cache_files.py
+import os
+
+
+def remove_stale_cache_files(cache_dir, stem, keep):
+    """Delete files in cache_dir whose names start with stem but not with keep.
+
+    stem and keep are file name prefixes, either a string or a tuple of them
+    (as for str.startswith).
+    """
+    for name in os.listdir(cache_dir):
+        if name.startswith(stem) and not name.startswith(keep):
+            try:
+                os.remove(os.path.join(cache_dir, name))
+            except OSError:
+                pass
@@ -1,62 +1,264 @@
 # backend/ collab_filtering.py
+import numpy as np
 import pandas as pd
-from surprise import Dataset, Reader, SVD
-from surprise.model_selection import train_test_split
+from scipy.sparse import csr_matrix
+from sklearn.decomposition import TruncatedSVD
 import os
-import pickle
-from surprise import accuracy
-from surprise.model_selection import cross_validate
+from typing import NamedTuple, Tuple
+from cache_files import remove_stale_cache_files
 
-import logging 
+import logging
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO) 
+logger.setLevel(logging.INFO)
+
+# Bump whenever build_user_item_matrix's arrays change (dtypes, id handling), so
+# caches written by older code are rebuilt instead of served (and their files removed)
+USER_ITEM_CACHE_VERSION = 1
+
+
+def index_of(sorted_ids, raw_ids):
+    """Position of each raw id in a sorted id array, or -1 where it is absent."""
+    raw_ids = np.asarray(raw_ids)
+    if len(sorted_ids) == 0:
+        return np.full(raw_ids.shape, -1, dtype=np.int64)
+    positions = np.minimum(np.searchsorted(sorted_ids, raw_ids), len(sorted_ids) - 1)
+    return np.where(sorted_ids[positions] == raw_ids, positions, -1)
+
+
+class UserItemMatrix(NamedTuple):
+    """Sparse user x anime ratings with the raw ids of its rows and columns."""
+    matrix: csr_matrix
+    user_ids: np.ndarray
+    anime_ids: np.ndarray
+
+    def rated_anime(self, user_id):
+        """Raw anime ids the user has rated, read from the user's CSR row."""
+        row = index_of(self.user_ids, user_id)
+        if row < 0:
+            return self.anime_ids[:0]
+        start, stop = self.matrix.indptr[row], self.matrix.indptr[row + 1]
+        return self.anime_ids[self.matrix.indices[start:stop]]
+
+
+def read_ratings(ratings_path):
+    """Read the user_id/anime_id/rating columns of the ratings CSV with compact dtypes."""
+    return pd.read_csv(
+        ratings_path,
+        engine='pyarrow',
+        usecols=['user_id', 'anime_id', 'rating'],
+        dtype={'user_id': np.int32, 'anime_id': np.int32, 'rating': np.float32}
+    )
+
+
+def build_user_item_matrix(ratings_df):
+    """Build the CSR user x anime ratings matrix once from the ratings table."""
+    user_ids, rows = np.unique(ratings_df['user_id'].to_numpy(), return_inverse=True)
+    anime_ids, cols = np.unique(ratings_df['anime_id'].to_numpy(), return_inverse=True)
+    matrix = csr_matrix(
+        (ratings_df['rating'].to_numpy(np.float32), (rows, cols)),
+        shape=(len(user_ids), len(anime_ids))
+    )
+    return UserItemMatrix(matrix, user_ids, anime_ids.astype(np.int32))
+
+
+def load_user_item_matrix(ratings_path, cache_dir):
+    """build_user_item_matrix for a ratings CSV, cached as memory-mapped .npy files.
+
+    The cache is keyed by USER_ITEM_CACHE_VERSION and the CSV's size and mtime, so
+    restarts skip parsing the ratings and workers share the arrays through the
+    page cache. Rebuilding removes the cache files of other versions.
+    """
+    stat = os.stat(ratings_path)
+    prefix = os.path.join(cache_dir, f"user_item-v{USER_ITEM_CACHE_VERSION}-{stat.st_size}-{stat.st_mtime_ns}")
+    fields = ('data', 'indices', 'indptr', 'user_ids', 'anime_ids')
+
+    if not all(os.path.exists(f"{prefix}-{field}.npy") for field in fields):
+        user_item = build_user_item_matrix(read_ratings(ratings_path))
+        arrays = {
+            'data': user_item.matrix.data,
+            'indices': user_item.matrix.indices,
+            'indptr': user_item.matrix.indptr,
+            'user_ids': user_item.user_ids,
+            'anime_ids': user_item.anime_ids,
+        }
+        os.makedirs(cache_dir, exist_ok=True)
+        remove_stale_cache_files(cache_dir, 'user_item-', os.path.basename(prefix) + '-')
+        for field, array in arrays.items():
+            tmp_path = f"{prefix}-{field}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                np.save(f, array)
+            os.replace(tmp_path, f"{prefix}-{field}.npy")
+        logger.info(f"Cached user x anime matrix under {prefix}-*.npy")
+
+    arrays = {field: np.load(f"{prefix}-{field}.npy", mmap_mode='r') for field in fields}
+    matrix = csr_matrix(
+        (arrays['data'], arrays['indices'], arrays['indptr']),
+        shape=(len(arrays['user_ids']), len(arrays['anime_ids']))
+    )
+    return UserItemMatrix(matrix, arrays['user_ids'], arrays['anime_ids'])
+
+
+class FactorModel(NamedTuple):
+    """Biased matrix-factorization model: r_ui = mu + bu + bi + pu . qi.
+
+    Rows of pu/bu follow the sorted raw user_ids and rows of qi/bi follow the
+    sorted raw anime_ids, so raw ids map to factor rows with a binary search.
+    """
+    pu: np.ndarray
+    qi: np.ndarray
+    bu: np.ndarray
+    bi: np.ndarray
+    global_mean: float
+    user_ids: np.ndarray
+    anime_ids: np.ndarray
+    rating_scale: Tuple[float, float]
+
+    def predict(self, user_id, anime_id):
+        """Predicted rating for a single user/anime pair."""
+        return float(predict_ratings(self, user_id, [anime_id])[0])
+
+
+def fit_factor_model(ratings_df, n_factors=50, reg_user=15.0, reg_item=10.0,
+                     rating_scale=(1, 10), random_state=42):
+    """Fit baseline biases, then a TruncatedSVD of the residual rating matrix.
+
+    Unrated cells of the residual matrix are zero, i.e. "no deviation from the
+    baseline", so the low-rank part only moves predictions where the data does.
+    """
+    user_item = build_user_item_matrix(ratings_df)
+    ratings = user_item.matrix.tocoo()
+    rows, cols = ratings.row, ratings.col
+    values = ratings.data.astype(np.float64)
+    n_users, n_items = ratings.shape
+
+    # Regularized item then user deviations from the global mean
+    global_mean = values.mean()
+    bi = np.bincount(cols, values - global_mean, n_items) / (reg_item + np.bincount(cols, minlength=n_items))
+    bu = np.bincount(rows, values - global_mean - bi[cols], n_users) / (reg_user + np.bincount(rows, minlength=n_users))
+
+    residuals = csr_matrix(
+        (values - global_mean - bu[rows] - bi[cols], (rows, cols)),
+        shape=(n_users, n_items)
+    )
+    svd = TruncatedSVD(n_components=n_factors, random_state=random_state)
+    pu = svd.fit_transform(residuals)
+
+    return FactorModel(
+        pu=np.ascontiguousarray(pu, dtype=np.float32),
+        qi=np.ascontiguousarray(svd.components_.T, dtype=np.float32),
+        bu=bu.astype(np.float32),
+        bi=bi.astype(np.float32),
+        global_mean=float(global_mean),
+        user_ids=user_item.user_ids,
+        anime_ids=user_item.anime_ids,
+        rating_scale=rating_scale
+    )
+
+
+def predict_pairs(model, user_ids, anime_ids):
+    """Predicted rating for each (user_id, anime_id) pair, clipped to the rating scale."""
+    inner_uids = index_of(model.user_ids, user_ids)
+    inner_iids = index_of(model.anime_ids, anime_ids)
+    known_users = inner_uids >= 0
+    known_items = inner_iids >= 0
+    both = known_users & known_items
+
+    est = np.full(len(inner_uids), model.global_mean, dtype=np.float64)
+    est[known_users] += model.bu[inner_uids[known_users]]
+    est[known_items] += model.bi[inner_iids[known_items]]
+    est[both] += np.einsum('ij,ij->i', model.pu[inner_uids[both]], model.qi[inner_iids[both]])
+    return np.clip(est, *model.rating_scale)
 
 
 def train_collab_model(ratings_path):
     # Load data
-    ratings_df = pd.read_csv(ratings_path)
-    
-    # Sample data if too large
-    if len(ratings_df) > 1000000:
-        ratings_df = ratings_df.sample(1000000, random_state=42)
-    
-    # Train/test split
-    reader = Reader(rating_scale=(1, 10))
-    data = Dataset.load_from_df(ratings_df[['user_id', 'anime_id', 'rating']], reader)
-    
-    # Cross-validation
-    cv_results = cross_validate(
-        SVD(n_factors=50, n_epochs=20, lr_all=0.003, reg_all=0.05),
-        data,
-        measures=['RMSE', 'MAE'],
-        cv=3,
-        verbose=True
+    ratings_df = read_ratings(ratings_path)
+
+    # Holdout evaluation (80/20 split)
+    test_mask = np.random.default_rng(42).random(len(ratings_df)) < 0.2
+    holdout_model = fit_factor_model(ratings_df[~test_mask])
+    test_df = ratings_df[test_mask]
+    errors = predict_pairs(holdout_model, test_df['user_id'], test_df['anime_id']) - test_df['rating'].to_numpy()
+    logger.info(
+        f"Holdout RMSE: {np.sqrt(np.mean(errors ** 2)):.4f}, "
+        f"MAE: {np.mean(np.abs(errors)):.4f} on {len(test_df)} ratings"
     )
-    
+
     # Final training
-    trainset = data.build_full_trainset()
-    model = SVD(
-        n_factors=50,
-        n_epochs=20,
-        lr_all=0.003,
-        reg_all=0.05,
-        random_state=42
-    )
-    model.fit(trainset)
-    
-    return model
+    return fit_factor_model(ratings_df)
+
+def predict_ratings(model, user_id, anime_ids, prediction_table=None):
+    """Predict ratings for many anime at once using the model factors directly.
+
+    Computes mu + bu + bi + qi . pu for every anime with a single matrix-vector
+    product, clipped to the rating scale. If a table from build_prediction_table
+    is given, known user/item pairs are read from it instead.
+    """
+    return predict_item_ratings(model, user_id, index_of(model.anime_ids, anime_ids), prediction_table)
+
+def predict_item_ratings(model, user_id, inner_iids, prediction_table=None):
+    """Same as predict_ratings, but for factor rows already resolved with index_of.
+
+    Lets callers map their catalog to factor rows once instead of per request.
+    """
+    known_items = inner_iids >= 0
+    known_iids = inner_iids[known_items]
+    lower_bound, higher_bound = model.rating_scale
+
+    inner_uid = index_of(model.user_ids, user_id)
+    known_user = inner_uid >= 0
+    if known_user and prediction_table is not None:
+        est = np.full(len(inner_iids), model.global_mean + model.bu[inner_uid], dtype=np.float64)
+        est[known_items] = prediction_table[inner_uid, known_iids]
+        return np.clip(est, lower_bound, higher_bound)
+
+    est = np.full(len(inner_iids), model.global_mean, dtype=np.float64)
+    est[known_items] += model.bi[known_iids]
+
+    if known_user:
+        est += model.bu[inner_uid]
+        # One GEMV over the contiguous factor matrix, then gather, avoids copying qi rows
+        est[known_items] += (model.qi @ model.pu[inner_uid])[known_iids]
+
+    return np.clip(est, lower_bound, higher_bound)
+
+def build_prediction_table(model, dtype=np.float32, chunk_size=4096):
+    """Precompute clipped predicted ratings for every (user, item) pair in the model.
+
+    Rows follow model.user_ids and columns model.anime_ids. Users are processed
+    in chunks so the GEMM temporaries stay small.
+    """
+    n_users, n_items = len(model.user_ids), len(model.anime_ids)
+    lower_bound, higher_bound = model.rating_scale
+    table = np.empty((n_users, n_items), dtype=dtype)
+    item_bias = model.bi + model.global_mean
+
+    for start in range(0, n_users, chunk_size):
+        stop = min(start + chunk_size, n_users)
+        block = model.pu[start:stop] @ model.qi.T
+        block += model.bu[start:stop, None]
+        block += item_bias
+        np.clip(block, lower_bound, higher_bound, out=block)
+        table[start:stop] = block
+
+    logger.info(f"Built {table.shape[0]}x{table.shape[1]} prediction table ({table.nbytes / 1e6:.1f} MB)")
+    return table
 
-def save_model(model,filename = 'collab_model.pkl'):
-    with open(filename, 'wb') as f:
-        pickle.dump(model,f)
+def save_model(model, dirname='collab_model'):
+    """Save each model field as a plain .npy file so the factors can be memory-mapped on load."""
+    os.makedirs(dirname, exist_ok=True)
+    for field in FactorModel._fields:
+        np.save(os.path.join(dirname, f'{field}.npy'), np.asarray(getattr(model, field)))
 
-def load_model(filename='collab_model.pkl'):
+def load_model(dirname='collab_model', mmap_mode='r'):
     try:
-        with open(filename, 'rb') as f:
-            model = pickle.load(f)
-            if not hasattr(model, 'predict'):
-                raise AttributeError("Model missing predict method")
-            return model
+        arrays = {
+            field: np.load(os.path.join(dirname, f'{field}.npy'), mmap_mode=mmap_mode)
+            for field in FactorModel._fields
+        }
+        arrays['global_mean'] = float(arrays['global_mean'])
+        arrays['rating_scale'] = tuple(arrays['rating_scale'].tolist())
+        return FactorModel(**arrays)
     except Exception as e:
         logger.error(f"Error loading model: {str(e)}")
-        return None
\ No newline at end of file
+        return None
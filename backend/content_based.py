@@ -1,20 +1,34 @@
 # backend/content_based.py
 
 import os
+import hashlib
+import numpy as np
 import pandas as pd
 from sklearn.preprocessing import MultiLabelBinarizer
-from sklearn.metrics.pairwise import cosine_similarity
-from difflib import get_close_matches, SequenceMatcher
+from rapidfuzz import fuzz, process
 import logging
 import ast
 import re
+from functools import lru_cache
 from typing import Tuple, Union, Set
+from cache_files import remove_stale_cache_files
 
 # ===================== CONSTANTS =======================
 GENRE_WEIGHT = 0.5
 RATING_WEIGHT = 0.3
 POPULARITY_WEIGHT = 0.2
 
+# Bump whenever load_and_preprocess_data's output changes, so cached frames built
+# by older code are rebuilt instead of served (and their files removed)
+PREPROCESS_CACHE_VERSION = 1
+# Bump whenever the cached similarity arrays (normalized rows, top-K table and scores) change
+SIMILARITY_CACHE_VERSION = 1
+
+# Columns read from the anime CSV
+ANIME_COLUMNS = ['anime_id', 'name', 'genre', 'type', 'rating', 'members']
+# A non-empty genre list as written by str(list): "['Action', 'Sci-Fi']"
+PLAIN_GENRE_LIST = r"\['[^'\\]*'(?:, '[^'\\]*')*\]"
+
 SERIES_SIMILARITY_THRESHOLD = 0.85
 PERFECT_MATCH_THRESHOLD = 0.99
 
@@ -36,10 +50,63 @@ logger.setLevel(logging.INFO)
 
 # ===================== HELPER FUNCTIONS =======================
 
-def normalize(series: pd.Series) -> pd.Series:
-    """Normalize a numeric column 0-1."""
-    _range = series.max() - series.min()
-    return (series - series.min()) / _range if _range != 0 else 0.5
+def normalize(values) -> np.ndarray:
+    """Normalize a numeric column 0-1, on its float64 values rather than the Series."""
+    values = np.asarray(values, dtype=np.float64)
+    low = values.min()
+    _range = values.max() - low
+    return (values - low) / _range if _range != 0 else 0.5
+
+def parse_genre_lists(genre: pd.Series) -> pd.Series:
+    """Genre lists stored as strings back to lists; only unusual rows go through ast.literal_eval."""
+    parsed = genre.str.slice(2, -2).str.split("', '")
+    fallback = ~genre.str.fullmatch(PLAIN_GENRE_LIST).fillna(False).astype(bool)
+    if fallback.any():
+        parsed[fallback] = genre[fallback].map(lambda x: ast.literal_eval(x) if isinstance(x, str) else [])
+    return parsed
+
+def top_k_positions(scores: np.ndarray, k: int) -> np.ndarray:
+    """Positions of the k highest scores, best first, ties kept in position order (like a stable sort)."""
+    if k >= len(scores):
+        return np.argsort(-scores, kind='stable')
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+    kth_value = np.partition(scores, len(scores) - k)[len(scores) - k]
+    above = np.flatnonzero(scores > kth_value)
+    ties = np.flatnonzero(scores == kth_value)[:k - len(above)]
+    top = np.concatenate([above, ties])
+    return top[np.lexsort((top, -scores[top]))]
+
+def build_top_k_table(similarity_matrix, k: int = 200, block_size: int = 2048) -> np.ndarray:
+    """Each row's k+1 most similar rows (usually itself first), best first.
+
+    Ties keep row order, so filtering a row's neighbours to a candidate set gives
+    the same ranking as scoring those candidates directly, as long as enough survive.
+    similarity_matrix may be a dense matrix or SimilarityRows; it is read in row blocks.
+    """
+    n_rows = similarity_matrix.shape[0]
+    width = min(k + 1, n_rows)
+    # Row ids fit in 16 bits for any realistic catalog, halving the table
+    table = np.empty((n_rows, width), dtype=np.uint16 if n_rows <= np.iinfo(np.uint16).max + 1 else np.int32)
+    for start in range(0, n_rows, block_size):
+        block = np.asarray(similarity_matrix[start:start + block_size], dtype=np.float32)
+        for offset, row_scores in enumerate(block):
+            table[start + offset] = top_k_positions(row_scores, width)
+    logger.info(f"Built top-{width} neighbour table ({table.nbytes / 1e6:.1f} MB)")
+    return table
+
+def build_top_k_scores(similarity_matrix, top_k_table: np.ndarray, block_size: int = 2048) -> np.ndarray:
+    """Similarity of every build_top_k_table entry, in the matrix's dtype.
+
+    With these alongside the table, requests answered from the table never read
+    a full similarity row.
+    """
+    scores = np.empty(top_k_table.shape, dtype=similarity_matrix.dtype)
+    for start in range(0, len(top_k_table), block_size):
+        block = np.asarray(similarity_matrix[start:start + block_size])
+        positions = top_k_table[start:start + len(block)].astype(np.intp)
+        scores[start:start + len(block)] = np.take_along_axis(block, positions, axis=1)
+    return scores
 
 def clean_title(title: str) -> str:
     if not isinstance(title, str): return ""
@@ -49,44 +116,67 @@ def clean_title(title: str) -> str:
            .replace('!','')
            .strip())
 
-# Strip out seasons, parts, OVA, etc.
-def extract_series_name(title: str) -> str:
-    if not isinstance(title, str): return ""
-    normalized = title.lower().strip()
-    patterns = [
+def build_title_index(df: pd.DataFrame) -> dict:
+    """Map each cleaned title to the index of its first row for O(1) lookups."""
+    clean_names = df['clean_name'] if 'clean_name' in df.columns else df['name'].map(clean_title)
+    title_index = {}
+    for idx, name in zip(df.index, clean_names):
+        title_index.setdefault(name, idx)
+    return title_index
+
+# Strip out seasons, parts, OVA, etc. (compiled once, applied in this order)
+SERIES_SUFFIX_PATTERNS = [
+    re.compile(p, re.IGNORECASE) for p in (
         r'\s*season\s*\d+.*$', r'\s*s\d+.*$', r'\s*\d+nd\s+season.*$', r'\s*\d+rd\s+season.*$',
         r'\s*\d+th\s+season.*$', r'\s*part\s*\d+.*$', r'\s*part\s*[ivx]+.*$', r'\s*ova.*$',
         r'\s*ona.*$', r'\s*special.*$', r'\s*movie.*$', r'\s*film.*$', r'\s*recap.*$',
         r'\s*shippuden.*$', r'\s*shippuuden.*$', r'\s*kai.*$', r'\s*brotherhood.*$',
         r'\s*boruto.*$', r'\s*:\s*.*$', r'\s*-\s*.*$', r'\s*\(\d+\).*$', r'\s*\[.*\].*$',
         r'\s*episode\s*\d+.*$', r'\s*ep\s*\d+.*$'
-    ]
-    for p in patterns:
-        normalized = re.sub(p, '', normalized, flags=re.IGNORECASE)
+    )
+]
+# Any of the suffix patterns; titles it misses skip the ordered passes (which are not
+# equivalent to one sub with this union, since each pass sees the previous pass's output)
+SERIES_SUFFIX_ANY = re.compile('|'.join(f'(?:{p.pattern})' for p in SERIES_SUFFIX_PATTERNS), re.IGNORECASE)
+
+def extract_series_name(title: str) -> str:
+    if not isinstance(title, str): return ""
+    normalized = title.lower().strip()
+    if SERIES_SUFFIX_ANY.search(normalized):
+        for pattern in SERIES_SUFFIX_PATTERNS:
+            normalized = pattern.sub('', normalized)
     return ' '.join(normalized.split())
 
+# (variant, family) pairs in KNOWN_SERIES_FAMILIES order, so the first match still wins
+SERIES_FAMILY_VARIANTS = tuple(
+    (variant, fam) for fam, variants in KNOWN_SERIES_FAMILIES.items() for variant in variants
+)
+
+@lru_cache(maxsize=16384)
 def get_series_family(series_name: str) -> str:
+    """Known family of a series name (or the name itself); memoized per distinct name."""
     if not series_name: return ""
     lower = series_name.lower()
-    for fam, variants in KNOWN_SERIES_FAMILIES.items():
-        for v in variants:
-            if v in lower or lower in v:
-                return fam
+    for v, fam in SERIES_FAMILY_VARIANTS:
+        if v in lower or lower in v:
+            return fam
     return series_name
 
 def are_same_series(title1: str, title2: str, threshold: float = SERIES_SIMILARITY_THRESHOLD) -> bool:
     """Check if two anime titles are from same series/family."""
     if not title1 or not title2:
         return False
-    name1 = extract_series_name(title1)
-    name2 = extract_series_name(title2)
+    return same_series_names(extract_series_name(title1), extract_series_name(title2), threshold)
+
+def same_series_names(name1: str, name2: str, threshold: float = SERIES_SIMILARITY_THRESHOLD) -> bool:
+    """are_same_series for titles already reduced with extract_series_name."""
     if not name1 or not name2:
         return False
     if get_series_family(name1) == get_series_family(name2):
         return True
     if name1 == name2:
         return True
-    sim = SequenceMatcher(None, name1, name2).ratio()
+    sim = fuzz.ratio(name1, name2) / 100
     contains = (name1 in name2) or (name2 in name1)
     return sim >= threshold or contains
 
@@ -110,16 +200,32 @@ def filter_by_type(df_subset: pd.DataFrame, anime_type: Union[str, list, None])
         logger.warning("No 'type' column found in DataFrame, cannot filter by type")
         return df_subset
 
-    # Normalize type column to lowercase strings
-    df_subset['type'] = df_subset['type'].astype(str).str.lower()
-
-    # Keep rows where the type matches any of the desired types
-    mask = df_subset['type'].isin(types)
-    filtered_df = df_subset[mask].copy()
+    if isinstance(df_subset['type'].dtype, pd.CategoricalDtype):
+        # Already lowercase categories: compare the integer codes
+        type_codes = df_subset['type'].cat.categories.get_indexer(types)
+        mask = np.isin(df_subset['type'].cat.codes.to_numpy(), type_codes[type_codes >= 0])
+    else:
+        # Compare lowercased types without rewriting the caller's column
+        mask = df_subset['type'].astype(str).str.lower().isin(types).to_numpy()
+    filtered_df = df_subset[mask]
 
     logger.info(f"Filtered from {len(df_subset)} to {len(filtered_df)} anime for types: {types}")
     return filtered_df
 
+def build_type_masks(df: pd.DataFrame) -> dict:
+    """Row mask of each lowercase anime type, built once so type filters become ORs of bool arrays."""
+    types = df['type'].astype(str).str.lower().astype('category')
+    codes = types.cat.codes.to_numpy()
+    return {anime_type: codes == code for code, anime_type in enumerate(types.cat.categories)}
+
+def combine_type_masks(type_masks: dict, types, n_rows: int) -> np.ndarray:
+    """Rows whose type is any of the given lowercase types, from build_type_masks output."""
+    mask = np.zeros(n_rows, dtype=bool)
+    for anime_type in types:
+        if anime_type in type_masks:
+            mask |= type_masks[anime_type]
+    return mask
+
 
 # ===================== CORE FUNCTIONS =======================
 
@@ -127,120 +233,289 @@ def load_and_preprocess_data(filepath: str) -> Tuple[pd.DataFrame, pd.DataFrame]
     """
     Load data, make genre multi-hot, normalize rating + members, build weighted feature matrix.
     Ensures 'type' column exists and is lowercase for consistent filtering.
+    The returned frame has one row per anime_id and a RangeIndex, so labels,
+    feature rows and similarity rows all share the same positions.
     """
     if not os.path.exists(filepath):
         raise FileNotFoundError(f"Dataset not found: {filepath}")
     
+    # Only parse the columns the recommender uses ('type' may be absent)
+    header = pd.read_csv(filepath, nrows=0).columns
     df = (
-        pd.read_csv(filepath)
+        pd.read_csv(
+            filepath, engine='pyarrow', dtype={'anime_id': 'int32'},
+            usecols=[c for c in ANIME_COLUMNS if c in header]
+        )
         .assign(name=lambda d: d['name'].str.replace('&#039;', "'"))
-        .pipe(lambda d: d[~d['genre'].isna()].copy())
+        .pipe(lambda d: d[~d['genre'].isna()].drop_duplicates('anime_id').reset_index(drop=True))
     )
 
+    # clean_title of every name, computed once with vectorized string ops
+    df['clean_name'] = (
+        df['name'].str.lower()
+        .str.replace(':', '', regex=False)
+        .str.replace('-', ' ', regex=False)
+        .str.replace('!', '', regex=False)
+        .str.strip()
+        .fillna('')
+    )
+
+    # extract_series_name of every name, so series checks skip the regex pass
+    df['series_name'] = df['name'].map(extract_series_name)
+    df['series_family'] = df['series_name'].map(get_series_family)
+
     # Ensure 'type' column exists and is lowercase
     if 'type' not in df.columns:
         df['type'] = 'unknown'
-    df['type'] = df['type'].astype(str).str.lower()
+    # Categorical: a handful of distinct types stored as small integer codes
+    df['type'] = df['type'].astype(str).str.lower().astype('category')
 
     # Convert genre column (list stored as string) to list
-    df['genre'] = df['genre'].apply(
-        lambda x: ast.literal_eval(x) if isinstance(x, str) else []
-    )
+    df['genre'] = parse_genre_lists(df['genre'])
 
     mlb = MultiLabelBinarizer()
-    genre_features = mlb.fit_transform(df['genre'])
-    genre_df = pd.DataFrame(genre_features, columns=mlb.classes_)
+    # Multi-hot genres as a compact uint8 array; weighted once when the features are assembled
+    genre_features = mlb.fit_transform(df['genre']).astype(np.uint8)
+
+    # Genre set of each anime as a bitmask (bit i is mlb.classes_[i]), so set tests are integer ops
+    if len(mlb.classes_) <= 64:
+        genre_bits = np.left_shift(np.uint64(1), np.arange(len(mlb.classes_), dtype=np.uint64))
+        df['genre_mask'] = genre_features.astype(np.uint64) @ genre_bits
+    else:
+        df['genre_mask'] = [sum(1 << int(j) for j in np.flatnonzero(row)) for row in genre_features]
 
-    df['rating']  = df['rating'].fillna(df['rating'].median())
-    df['members'] = df['members'].fillna(df['members'].median())
+    # Median imputation on the raw float64 values; columns without gaps are left as read
+    for column in ('rating', 'members'):
+        values = df[column].to_numpy(np.float64)
+        missing = np.isnan(values)
+        if missing.any():
+            df[column] = np.where(missing, np.nanmedian(values), values)
 
     df['rating_normalized']  = normalize(df['rating'])
     df['members_normalized'] = normalize(df['members'])
 
-    final_features = pd.concat([
-        genre_df * GENRE_WEIGHT,
-        df['rating_normalized'] * RATING_WEIGHT,
-        df['members_normalized'] * POPULARITY_WEIGHT
-    ], axis=1).fillna(0)
+    # One float64 block filled in place instead of per-column frames joined by pd.concat
+    values = np.empty((len(df), len(mlb.classes_) + 2), dtype=np.float64)
+    np.multiply(genre_features, GENRE_WEIGHT, out=values[:, :-2])
+    values[:, -2] = df['rating_normalized'].to_numpy(np.float64) * RATING_WEIGHT
+    values[:, -1] = df['members_normalized'].to_numpy(np.float64) * POPULARITY_WEIGHT
+    values[np.isnan(values)] = 0
+    final_features = pd.DataFrame(
+        values, columns=[*mlb.classes_, 'rating_normalized', 'members_normalized'], copy=False
+    )
 
     logger.info(f"Loaded & preprocessed {len(df)} anime. 'type' column ensured lowercase and present.")
     return df, final_features
 
 
-def build_similarity_matrix(features: pd.DataFrame):
-    return cosine_similarity(features)
+def load_and_preprocess_cached(filepath: str, cache_dir: str) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """load_and_preprocess_data, cached as Parquet files keyed by PREPROCESS_CACHE_VERSION
+    and the CSV's size and mtime.
+
+    Restarts read the preprocessed columns back instead of re-parsing the CSV
+    and every genre list. Rebuilding removes the cache files of other versions.
+    """
+    if not os.path.exists(filepath):
+        raise FileNotFoundError(f"Dataset not found: {filepath}")
+
+    stat = os.stat(filepath)
+    prefix = os.path.join(cache_dir, f"anime-v{PREPROCESS_CACHE_VERSION}-{stat.st_size}-{stat.st_mtime_ns}")
+    df_path, features_path = f"{prefix}-df.parquet", f"{prefix}-features.parquet"
+
+    if os.path.exists(df_path) and os.path.exists(features_path):
+        df = pd.read_parquet(df_path)
+        # Parquet list columns come back as arrays
+        df['genre'] = df['genre'].map(list)
+        return df, pd.read_parquet(features_path)
+
+    df, features = load_and_preprocess_data(filepath)
+
+    # Python-int genre masks (more than 64 genres) have no Parquet type
+    if df['genre_mask'].dtype != object:
+        os.makedirs(cache_dir, exist_ok=True)
+        remove_stale_cache_files(cache_dir, 'anime-', os.path.basename(prefix) + '-')
+        for frame, path in ((df, df_path), (features, features_path)):
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            frame.to_parquet(tmp_path)
+            os.replace(tmp_path, path)
+        logger.info(f"Cached preprocessed anime data under {prefix}-*.parquet")
+    return df, features
+
+
+def unit_rows(features: pd.DataFrame) -> np.ndarray:
+    """Feature rows L2-normalized in float64 (all-zero rows stay zero)."""
+    values = np.asarray(features, dtype=np.float64)
+    norms = np.linalg.norm(values, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return values / norms
+
+def build_similarity_matrix(features: pd.DataFrame, dtype=np.float32, block_size: int = 2048):
+    """Cosine similarity of all anime pairs, stored compactly (float32 by default).
+
+    Rows are L2-normalized once and the product is filled in row blocks, so no
+    full-size float64 matrix is ever held alongside the compact one.
+    """
+    unit = unit_rows(features)
+
+    n_rows = len(unit)
+    similarity = np.empty((n_rows, n_rows), dtype=dtype)
+    for start in range(0, n_rows, block_size):
+        stop = min(start + block_size, n_rows)
+        similarity[start:stop] = unit[start:stop] @ unit.T
+    return similarity
+
+class SimilarityRows:
+    """Stand-in for build_similarity_matrix output that computes rows on demand.
+
+    Only the normalized feature rows are kept (N x features instead of N x N);
+    indexing a row or a slice of rows runs the same float64 product and
+    rounding as build_similarity_matrix with the same dtype, so the values
+    match it. Rows are float32 by default: nothing N x N is stored, so a
+    narrower dtype would only add ties. unit can pass rows already normalized
+    with unit_rows (e.g. a memory-mapped cache).
+    """
+
+    def __init__(self, features: pd.DataFrame, dtype=np.float32, unit: np.ndarray = None):
+        self.unit = unit_rows(features) if unit is None else unit
+        self.dtype = dtype
+        self.shape = (len(self.unit), len(self.unit))
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, rows):
+        if isinstance(rows, slice):
+            return (self.unit[rows] @ self.unit.T).astype(self.dtype)
+        return (self.unit[[rows]] @ self.unit.T)[0].astype(self.dtype)
+
+def features_digest(features: pd.DataFrame) -> str:
+    """Short content hash of the feature matrix, used to key arrays derived from it."""
+    values = np.ascontiguousarray(features, dtype=np.float64)
+    return hashlib.sha1(values.tobytes()).hexdigest()[:16]
+
+def cached_array(path: str, build):
+    """Load a .npy array memory-mapped from path, building and saving it first if missing."""
+    if not os.path.exists(path):
+        array = build()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.save(f, array)
+        os.replace(tmp_path, path)
+        logger.info(f"Saved {array.shape} array to {path}")
+    return np.load(path, mmap_mode='r')
 
 def get_recommendations(
     title: str,
     df: pd.DataFrame,
     similarity_matrix,
     n: int = 5,
-    anime_type: str = None
+    anime_type: str = None,
+    title_index: dict = None,
+    top_k_table: np.ndarray = None,
+    type_masks: dict = None,
+    top_k_scores: np.ndarray = None
 ) -> Union[pd.DataFrame, None]:
 
     if not title or len(title.strip()) < 2:
         logger.warning("Invalid title input")
         return None
 
+    # Callers should pass a prebuilt index; building it here costs a full pass
+    if title_index is None:
+        title_index = build_title_index(df)
+
     cleaned = clean_title(title)
-    exact_match = df[df['name'].apply(clean_title) == cleaned]
+    idx = title_index.get(cleaned)
 
-    if not exact_match.empty:
-        idx = exact_match.index[0]
-    else:
-        matches = get_close_matches(
-            cleaned, df['name'].apply(clean_title).tolist(), n=3, cutoff=0.7
+    if idx is None:
+        # The index keys are the cleaned titles; scan them in place (no list copy)
+        match = process.extractOne(
+            cleaned, title_index.keys(), scorer=fuzz.ratio, score_cutoff=70
         )
-        if not matches:
+        if match is None:
             logger.warning(f"No matches found for '{title}'")
             return None
-        idx = df[df['name'].apply(clean_title) == matches[0]].index[0]
+        idx = title_index[match[0]]
 
-    # Apply type filtering first to the candidate set
-    candidate_indices = df.index.tolist()
+    # Apply type filtering first to the candidate set (never the target itself)
+    candidate_mask = np.ones(len(df), dtype=bool)
     if anime_type and anime_type.lower() != 'all':
-        filtered_df = filter_by_type(df, anime_type)
-        candidate_indices = filtered_df.index.tolist()
-        if idx not in candidate_indices:
-            # Always include the target anime itself
-            candidate_indices.append(idx)
-
-    # Get similarity scores only among candidates
-    sim_scores = [(i, similarity_matrix[idx][i]) for i in candidate_indices if i != idx]
-    sim_scores = sorted(sim_scores, key=lambda x: x[1], reverse=True)[:n*3]
+        if type_masks is not None:
+            types = [t.strip().lower() for t in anime_type.split(',')]
+            candidate_mask = combine_type_masks(type_masks, types, len(df))
+        else:
+            candidate_mask = df.index.isin(filter_by_type(df, anime_type).index)
+    candidate_mask[idx] = False
+
+    # Best candidates from the precomputed neighbour table; scan the whole row
+    # only when too few of the table's neighbours pass the type filter
+    k = n * 3
+    neighbours = None
+    if top_k_table is not None:
+        kept = np.flatnonzero(candidate_mask[top_k_table[idx]])[:k]
+        neighbours = top_k_table[idx][kept]
+        if len(neighbours) < k and top_k_table.shape[1] < len(df) and len(neighbours) < candidate_mask.sum():
+            neighbours = None
+    if neighbours is not None and top_k_scores is not None:
+        # Scores stored next to the table: no similarity row needed
+        neighbour_scores = np.asarray(top_k_scores[idx][kept], dtype=np.float32)
+    else:
+        # One row read (a view of a dense matrix, or one product for SimilarityRows)
+        row_scores = similarity_matrix[idx]
+        if neighbours is None:
+            candidates = np.flatnonzero(candidate_mask)
+            candidate_scores = np.asarray(row_scores, dtype=np.float32)[candidates]
+            neighbours = candidates[top_k_positions(candidate_scores, k)]
+        neighbour_scores = np.asarray(row_scores[neighbours], dtype=np.float32)
+    sim_scores = list(zip(neighbours.tolist(), neighbour_scores.tolist()))
 
     # Filter out same series
-    sim_scores_filtered = [
-        (i, score) for (i, score) in sim_scores
-        if not are_same_series(df.iloc[i]['name'], df.iloc[idx]['name'])
-    ]
+    series_names = df['series_name'].to_numpy()
+    target_name = series_names[idx]
+    if target_name:
+        # Candidates in the target's series family are dropped with one array comparison;
+        # only the others need the name-similarity checks of same_series_names
+        other_family = df['series_family'].to_numpy()[neighbours] != df['series_family'].iat[idx]
+        sim_scores_filtered = [
+            (i, score) for (i, score), keep in zip(sim_scores, other_family.tolist())
+            if keep and not same_series_names(series_names[i], target_name)
+        ]
+    else:
+        sim_scores_filtered = sim_scores
 
-    # Diverse genres
+    # Diverse genres (a genre set is new unless its mask is covered by the seen mask)
+    genre_masks = df['genre_mask'].to_numpy()
     selected = []
-    seen_genres = set()
+    selected_ids = set()
+    seen_genres = 0
     for i, score in sim_scores_filtered:
         if len(selected) >= n:
             break
-        curr_gen = set(df.iloc[i]['genre'])
-        if len(selected) < n // 2 or not curr_gen.issubset(seen_genres):
+        curr_gen = int(genre_masks[i])
+        if len(selected) < n // 2 or curr_gen & ~seen_genres:
             selected.append((i, score))
-            seen_genres.update(curr_gen)
+            selected_ids.add(i)
+            seen_genres |= curr_gen
 
     # Fallback if not enough
     if len(selected) < n:
         for i, score in sim_scores_filtered:
             if len(selected) >= n:
                 break
-            if i not in [s[0] for s in selected]:
+            if i not in selected_ids:
                 selected.append((i, score))
+                selected_ids.add(i)
 
+    # Gather the selected rows once, then read each output column from them
+    selected_rows = df.iloc[[i for i, _ in selected]]
     recommendations = pd.DataFrame({
-        'Anime': df.iloc[[i for i, _ in selected]]['name'].values,
+        'Anime': selected_rows['name'].values,
         'Similarity Score': [round(s, 4) for _, s in selected],
-        'Rating': df.iloc[[i for i, _ in selected]]['rating'].values,
-        'Genres': df.iloc[[i for i, _ in selected]]['genre'].tolist(),
+        'Rating': selected_rows['rating'].values,
+        'Genres': selected_rows['genre'].tolist(),
         'Content_Score': [s for _, s in selected],
-        'Type': df.iloc[[i for i, _ in selected]]['type'].values
+        'Type': selected_rows['type'].tolist()
     })
 
     return recommendations
@@ -0,0 +1,18 @@
+# backend/gunicorn.conf.py
+"""
+Gunicorn settings for serving the recommendation API:
+
+    cd backend && gunicorn wsgi:app
+
+The app is imported once in the master before forking (preload_app), so the
+catalog, similarity features and model factors are shared copy-on-write by all
+workers instead of being loaded once per worker.
+"""
+import multiprocessing
+import os
+
+wsgi_app = 'wsgi:app'
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+preload_app = True
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+timeout = 120
@@ -0,0 +1,63 @@
+# backend/tests/test_single_flight.py
+"""
+In-process checks for app.single_flight (needs the same data and trained model
+as the server):
+
+    cd backend && python tests/test_single_flight.py
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app as ani_app
+
+
+def lock_calls(call):
+    """Run call() and return its result and the lock keys it passed to cache.add/cache.delete"""
+    cache = ani_app.cache
+    seen = []
+    originals = {name: getattr(cache, name) for name in ('add', 'delete')}
+
+    def recorder(name):
+        def method(key, *args, **kwargs):
+            seen.append((name, key))
+            return originals[name](key, *args, **kwargs)
+        return method
+
+    for name in originals:
+        setattr(cache, name, recorder(name))
+    try:
+        result = call()
+    finally:
+        for name in originals:
+            delattr(cache, name)
+    return result, [(name, key) for name, key in seen if key.startswith('lock:')]
+
+
+def check_warm_hit_skips_lock(func, *args):
+    """A miss takes and releases the lock; the following warm hit never touches it"""
+    cache_key = func.make_cache_key(func.uncached, *args)
+    ani_app.cache.delete(cache_key)
+
+    cold, cold_locks = lock_calls(lambda: func(*args))
+    assert [name for name, _ in cold_locks] == ['add', 'delete'], cold_locks
+
+    warm, warm_locks = lock_calls(lambda: func(*args))
+    assert warm_locks == [], warm_locks
+    assert warm == cold
+
+
+def test_content_warm_hit_skips_lock():
+    title = ani_app.df['name'].iloc[0].lower()
+    check_warm_hit_skips_lock(ani_app.cached_content_recommendations, title, 5, 'all')
+
+
+def test_collab_warm_hit_skips_lock():
+    user_id = int(ani_app.user_item_matrix.user_ids[0])
+    check_warm_hit_skips_lock(ani_app.cached_collab_top, user_id, 'all')
+
+
+if __name__ == "__main__":
+    test_content_warm_hit_skips_lock()
+    test_collab_warm_hit_skips_lock()
+    print("✓ Warm cache hits skip the single-flight lock")
@@ -0,0 +1,30 @@
+# backend/train.py
+"""
+Offline training for the collaborative filtering model.
+Run this before starting the API; app.py only loads the saved artifact.
+
+    cd backend && python train.py
+"""
+import os
+import logging
+from collab_filtering import train_collab_model, save_model
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+backend_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(backend_dir)
+ratings_path = os.path.join(project_root, 'data', 'clean_ratings.csv')
+model_path = os.path.join(backend_dir, 'collab_model')
+
+def main():
+    if not os.path.exists(ratings_path):
+        raise FileNotFoundError(f"Ratings data not found at: {ratings_path}")
+
+    logger.info("Training collaborative model...")
+    model = train_collab_model(ratings_path)
+    save_model(model, model_path)
+    logger.info(f"Collaborative model saved to {model_path}")
+
+if __name__ == '__main__':
+    main()
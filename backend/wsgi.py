@@ -0,0 +1,9 @@
+# backend/wsgi.py
+"""
+WSGI entry point for production servers:
+
+    cd backend && gunicorn wsgi:app
+"""
+from app import app
+
+__all__ = ['app']
@@ -1,4 +1,5 @@
 # data_cleaning.py
+import numpy as np
 import pandas as pd
 from sklearn.preprocessing import MultiLabelBinarizer
 import os
@@ -22,17 +23,17 @@ def clean_anime_data():
         os.makedirs(os.path.dirname(get_data_path('')), exist_ok=True)
         
         # Load and clean data
-        anime_df = pd.read_csv(get_data_path('anime.csv'))
+        anime_df = pd.read_csv(get_data_path('anime.csv'), engine='pyarrow')
         
         anime_df = anime_df.assign(
             name=lambda x: x['name'].str.replace('&#039;', "'"),
             genre=lambda x: x['genre'].apply(clean_genres)
         ).pipe(lambda df: df[df['genre'].apply(len) > 0])  # Remove anime with no genres
         
-        # Encode genres
+        # Encode genres (0/1 flags as uint8 rather than int64)
         mlb = MultiLabelBinarizer()
         genre_encoded = pd.DataFrame(
-            mlb.fit_transform(anime_df['genre']),
+            mlb.fit_transform(anime_df['genre']).astype(np.uint8),
             columns=[f"genre_{g}" for g in mlb.classes_],
             index=anime_df.index
         )
@@ -49,14 +50,16 @@ def clean_anime_data():
 
 def clean_ratings_data():
     try:
-        ratings = pd.read_csv(get_data_path('rating.csv'))
+        # Multithreaded Arrow parser; the ratings file has millions of rows
+        ratings = pd.read_csv(get_data_path('rating.csv'), engine='pyarrow')
         
         ratings_clean = (
             ratings
             .query('rating > 0')  # Remove negative ratings
             .assign(
                 rating=lambda x: x['rating'].clip(3, 9),  # Cap ratings
-                user_id=lambda x: x.groupby('user_id').ngroup() + 1  # Normalize IDs
+                # Normalize IDs: sorted factorize gives the same 1..n numbering as groupby().ngroup()
+                user_id=lambda x: pd.factorize(x['user_id'], sort=True)[0] + 1
             )
             .drop_duplicates(['user_id', 'anime_id'])  # Remove duplicates
         )